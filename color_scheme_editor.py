@@ -1,18 +1,41 @@
 import sublime
 import sublime_plugin
-from os.path import join, exists, basename, normpath, dirname, isfile
-from os import listdir, makedirs, chmod, unlink
+from os.path import join, exists, basename, normpath, dirname, isfile, getmtime
+from os import listdir, makedirs, chmod, unlink, walk
+from fnmatch import fnmatch
 from os import stat as osstat
 import stat
 import subprocess
+import codecs
+import time
 
 ST3 = int(sublime.version()) >= 3000
 if ST3:
     from .lib.package_search import PackageSearch
-    from .lib.binary_manager import update_binary, check_version, get_binary_location
+    from .lib.binary_manager import update_binary, check_version_async, get_binary_location
+    from .lib.scheme_colors import SchemeColors, OPERATIONS
+    from .lib import scheme_colors
+    from .lib.scheme_audit import audit, format_results
+    from .lib.scheme_rules import parse_scheme, rule_lines
+    from .lib.scope_index import ScopeIndex, benchmark
+    from .lib.scheme_merge import diff, merge, format_diff, format_conflicts
+    from .lib.timing import span, read_trace, summarize, TRACE_FILE
+    from .lib import timing
+    from .lib.log_tail import LogTail, start_session
+    from .lib.file_rotate import rotate
 else:
     from lib.package_search import PackageSearch
-    from lib.binary_manager import update_binary, check_version, get_binary_location
+    from lib.binary_manager import update_binary, check_version_async, get_binary_location
+    from lib.scheme_colors import SchemeColors, OPERATIONS
+    from lib import scheme_colors
+    from lib.scheme_audit import audit, format_results
+    from lib.scheme_rules import parse_scheme, rule_lines
+    from lib.scope_index import ScopeIndex, benchmark
+    from lib.scheme_merge import diff, merge, format_diff, format_conflicts
+    from lib.timing import span, read_trace, summarize, TRACE_FILE
+    from lib import timing
+    from lib.log_tail import LogTail, start_session
+    from lib.file_rotate import rotate
 
 PLUGIN_NAME = "ColorSchemeEditor"
 THEME_EDITOR = None
@@ -22,6 +45,9 @@ PLUGIN_SETTINGS = 'color_scheme_editor.sublime-settings'
 PREFERENCES = 'Preferences.sublime-settings'
 SCHEME = "color_scheme"
 THEMES = "theme-list.sublime-settings"
+LOG_FILE = "subclrschm.log"
+SCOPE_INDEXES = {}
+LOG_TAIL = None
 
 
 MSGS = {
@@ -45,9 +71,52 @@ Would you like to download the subclrschm binary now?
 
     "no_updates": '''Color Scheme Editor:
 No updates available at this time.
+''',
+
+    "checking": "Color Scheme Editor: Already checking for subclrschm updates",
+
+    "transform": '''Color Scheme Editor:
+Could not transform the color scheme.
+''',
+
+    "audit": '''Color Scheme Editor:
+Could not audit the color scheme.
+''',
+
+    "scope_index": '''Color Scheme Editor:
+Could not read the scope rules of %s.
+Only tmTheme color schemes are supported.
+''',
+
+    "not_temp": '''Color Scheme Editor:
+The current color scheme is not a copy in the temp folder.
+''',
+
+    "no_upstream": '''Color Scheme Editor:
+Could not find the original color scheme in the installed packages.
+''',
+
+    "no_base": '''Color Scheme Editor:
+No snapshot of the original color scheme exists for this copy.
+Open the original color scheme in the editor again to create one.
+''',
+
+    "diff": '''Color Scheme Editor:
+Could not compare the color scheme with the original.
+''',
+
+    "merge": '''Color Scheme Editor:
+Could not merge the color scheme.
 '''
 }
 
+TRANSFORM_PROMPTS = {
+    "hue": "Hue shift (degrees):",
+    "saturation": "Saturation factor (0 = greyscale):",
+    "lightness": "Lightness offset (-1.0 to 1.0):",
+    "remap": "Palette (#from:#to, ...):"
+}
+
 
 def load_resource(resource, binary=False):
     bfr = None
@@ -70,6 +139,60 @@ def load_resource(resource, binary=False):
     return bfr
 
 
+def find_schemes():
+    if ST3:
+        return sublime.find_resources("*.tmTheme")
+    schemes = []
+    packages = normpath(sublime.packages_path())
+    for base, dirs, files in walk(packages):
+        for f in files:
+            if fnmatch(f, "*.tmTheme"):
+                schemes.append(join(base, f).replace(packages, "Packages").replace("\\", "/"))
+    return schemes
+
+
+def show_panel(window, name, text):
+    if ST3:
+        view = window.create_output_panel(name)
+        view.run_command("append", {"characters": text})
+    else:
+        view = window.get_output_panel(name)
+        edit = view.begin_edit()
+        view.insert(edit, 0, text)
+        view.end_edit(edit)
+    window.run_command("show_panel", {"panel": "output.%s" % name})
+
+
+def get_scope_index(scheme):
+    """Return (index, rule lines, file path) for a scheme, rebuilding only when the file changes."""
+
+    path = join(dirname(sublime.packages_path()), normpath(scheme))
+    stamp = getmtime(path) if exists(path) else None
+    cached = SCOPE_INDEXES.get(scheme)
+    if cached is not None and cached[0] == stamp:
+        return cached[1:]
+
+    if stamp is not None:
+        with open(path, "rb") as f:
+            data = f.read()
+    else:
+        data = load_resource(scheme, binary=True)
+        path = None
+    index = ScopeIndex(parse_scheme(data)[2])
+    SCOPE_INDEXES[scheme] = (stamp, index, rule_lines(data), path)
+    return index, SCOPE_INDEXES[scheme][2], path
+
+
+def append_panel(view, text):
+    if ST3:
+        view.run_command("append", {"characters": text, "scroll_to_end": True})
+    else:
+        edit = view.begin_edit()
+        view.insert(edit, view.size(), text)
+        view.end_edit(edit)
+        view.show(view.size())
+
+
 def nix_check_permissions(bin):
     st = osstat(bin)
     if not bool(st.st_mode & stat.S_IEXEC):
@@ -126,6 +249,9 @@ class ColorSchemeEditorCommand(sublime_plugin.ApplicationCommand):
                 try:
                     with open(self.actual_scheme_file, "wb") as f:
                         f.write(text)
+                    # Keep a pristine copy to three-way merge against later upstream versions
+                    with open(self.actual_scheme_file + ".base", "wb") as f:
+                        f.write(text)
                 except:
                     sublime.error_message(MSGS["temp"])
                     return
@@ -137,33 +263,286 @@ class ColorSchemeEditorCommand(sublime_plugin.ApplicationCommand):
         elif action != "new" and action != "select":
             self.file_select = True
 
+    def launch(self, action, live_edit):
+        log = join(sublime.packages_path(), "User", LOG_FILE)
+        try:
+            if bool(self.p_settings.get("debug", False)):
+                rotate(log, int(self.p_settings.get("log_max_size_kb", 5120)) * 1024)
+            start_session(log)
+        except Exception as e:
+            print("ColorSchemeEditor: Could not prepare %s! (%s)" % (log, str(e)))
+
+        subprocess.Popen(
+            [THEME_EDITOR] +
+            (["-d"] if bool(self.p_settings.get("debug", False)) else []) +
+            (["-n"] if action == "new" else []) +
+            (["-s"] if self.file_select else []) +
+            (["-L"] if (live_edit is None and bool(self.p_settings.get("live_edit", True))) or (live_edit is not None and live_edit) else []) +
+            ["-l", join(sublime.packages_path(), "User")] +
+            ([self.actual_scheme_file] if self.actual_scheme_file is not None and exists(self.actual_scheme_file) else [])
+        )
+
     def run(self, action=None, select_theme=None, live_edit=None):
+        with span("color_scheme_editor.run"):
+            # Check if the binary is available
+            with span("color_scheme_editor.check_binary"):
+                if not self.check_binary():
+                    return
 
-        # Check if the binary is available
-        if not self.check_binary():
+            # Init settings.  Bail if returned an issue
+            with span("color_scheme_editor.init_settings"):
+                if not self.init_settings(action, select_theme):
+                    return
+
+            # Prepare the theme to be edited
+            # Copy to a temp location if desired before editing
+            with span("color_scheme_editor.prepare_theme"):
+                self.prepare_theme(action)
+
+            # Call the editor with the theme file
+            with span("color_scheme_editor.launch"):
+                try:
+                    self.launch(action, live_edit)
+                except:
+                    sublime.error_message(MSGS["access"])
+
+
+class ColorSchemeTransformCommand(ColorSchemeEditorCommand):
+    def prompt(self, action, select_theme, operation, save_as):
+        def on_done(value):
+            args = {"action": action, "select_theme": select_theme, "operation": operation, "save_as": save_as}
+            if operation == "remap":
+                args["palette"] = value
+            else:
+                args["amount"] = value
+            sublime.run_command("color_scheme_transform", args)
+
+        sublime.active_window().show_input_panel(TRANSFORM_PROMPTS[operation], "", on_done, None, None)
+
+    def transform(self, operation, amount, palette, save_as):
+        with codecs.open(self.actual_scheme_file, "r", "utf-8") as f:
+            colors = SchemeColors(f.read())
+
+        start = time.time()
+        colors.transform(operation, amount, palette)
+        text = colors.apply()
+        elapsed = (time.time() - start) * 1000.0
+
+        target = self.actual_scheme_file if save_as is None else join(dirname(self.actual_scheme_file), save_as)
+        with codecs.open(target, "w", "utf-8") as f:
+            f.write(text)
+
+        sublime.status_message(
+            "Color Scheme Editor: %s applied to %d colors in %.1fms (%s)" % (
+                operation, len(colors), elapsed, "numpy" if scheme_colors.numpy is not None else "python"
+            )
+        )
+
+    def run(self, action="current", select_theme=None, operation=None, amount=None, palette=None, save_as=None):
+        if operation not in OPERATIONS:
+            return
+
+        if (operation == "remap" and palette is None) or (operation != "remap" and amount is None):
+            self.prompt(action, select_theme, operation, save_as)
             return
 
         # Init settings.  Bail if returned an issue
         if not self.init_settings(action, select_theme):
             return
 
-        # Prepare the theme to be edited
-        # Copy to a temp location if desired before editing
+        # Work on the temp copy unless direct editing is enabled
         self.prepare_theme(action)
+        if self.actual_scheme_file is None or not exists(self.actual_scheme_file):
+            return
 
-        # Call the editor with the theme file
         try:
-            subprocess.Popen(
-                [THEME_EDITOR] +
-                (["-d"] if bool(self.p_settings.get("debug", False)) else []) +
-                (["-n"] if action == "new" else []) +
-                (["-s"] if self.file_select else []) +
-                (["-L"] if (live_edit is None and bool(self.p_settings.get("live_edit", True))) or (live_edit is not None and live_edit) else []) +
-                ["-l", join(sublime.packages_path(), "User")] +
-                ([self.actual_scheme_file] if self.actual_scheme_file is not None and exists(self.actual_scheme_file) else [])
+            self.transform(operation, amount, palette, save_as)
+        except Exception as e:
+            print(e)
+            sublime.error_message(MSGS["transform"])
+
+
+class ColorSchemeAuditCommand(ColorSchemeEditorCommand):
+    def audit_current(self, action, select_theme):
+        # Init settings.  Bail if returned an issue
+        if not self.init_settings(action, select_theme):
+            return []
+
+        # Audit the temp copy unless direct editing is enabled
+        self.prepare_theme(action)
+        if self.actual_scheme_file is None or not exists(self.actual_scheme_file):
+            return []
+        with open(self.actual_scheme_file, "rb") as f:
+            data = f.read()
+        return [(self.actual_scheme_file, data)]
+
+    def run(self, action="current", select_theme=None, sort="ratio"):
+        if action == "all":
+            schemes = [(s, load_resource(s, binary=True)) for s in find_schemes()]
+        else:
+            schemes = self.audit_current(action, select_theme)
+
+        start = time.time()
+        output = []
+        changed = 0
+        for scheme, data in schemes:
+            try:
+                results, computed = audit(scheme, data)
+            except Exception as e:
+                print("ColorSchemeEditor: Could not audit %s! (%s)" % (scheme, str(e)))
+                if action != "all":
+                    sublime.error_message(MSGS["audit"])
+                continue
+            changed += computed
+            output.append(format_results(scheme, results, sort))
+        elapsed = (time.time() - start) * 1000.0
+
+        if output:
+            show_panel(sublime.active_window(), "color_scheme_audit", "\n".join(output))
+            sublime.status_message(
+                "Color Scheme Editor: audited %d scheme(s), %d pair(s) recomputed in %.1fms" % (
+                    len(output), changed, elapsed
+                )
             )
-        except:
-            sublime.error_message(MSGS["access"])
+
+
+class ColorSchemeScopeRuleCommand(sublime_plugin.TextCommand):
+    def run(self, edit, jump=False):
+        scheme = self.view.settings().get(SCHEME, sublime.load_settings(PREFERENCES).get(SCHEME))
+        if scheme is None or len(self.view.sel()) == 0:
+            return
+        scope = self.view.scope_name(self.view.sel()[0].begin())
+
+        try:
+            index, lines, path = get_scope_index(scheme)
+        except Exception as e:
+            print(e)
+            sublime.error_message(MSGS["scope_index"] % scheme)
+            return
+        match = index.match(scope)[0]
+        if match is None:
+            sublime.status_message("Color Scheme Editor: no rule colors '%s'" % scope.strip())
+            return
+
+        rule = index.rules[match]
+        sublime.status_message(
+            "Color Scheme Editor: %s (%s)" % (rule["name"] if rule["name"] else "<unnamed>", rule["scope"])
+        )
+        if jump:
+            if path is not None and match < len(lines):
+                self.view.window().open_file("%s:%d" % (path, lines[match]), sublime.ENCODED_POSITION)
+            else:
+                sublime.status_message(
+                    "Color Scheme Editor: %s is archived; open it in the editor to get an editable copy" % scheme
+                )
+
+
+class ColorSchemeScopeBenchmarkCommand(sublime_plugin.TextCommand):
+    def run(self, edit, repeat=20):
+        scheme = self.view.settings().get(SCHEME, sublime.load_settings(PREFERENCES).get(SCHEME))
+        if scheme is None:
+            return
+        scopes = set()
+        pt = 0
+        while pt < self.view.size():
+            scopes.add(self.view.scope_name(pt))
+            pt += 16
+        scopes = list(scopes)
+
+        try:
+            index = get_scope_index(scheme)[0]
+        except Exception as e:
+            print(e)
+            sublime.error_message(MSGS["scope_index"] % scheme)
+            return
+        trie, linear = benchmark(index, scopes, repeat)
+        print(
+            "ColorSchemeEditor: %d scopes, %d rules: trie %.1fus, linear scan %.1fus per lookup" % (
+                len(scopes), len(index.rules), trie * 1000000.0, linear * 1000000.0
+            )
+        )
+        sublime.status_message("Color Scheme Editor: scope lookup benchmark written to console")
+
+
+class ColorSchemeMergeBase(object):
+    def get_sources(self, upstream):
+        """Return (temp copy path, base snapshot path, upstream resource) for the current scheme."""
+
+        current_scheme = sublime.load_settings(PREFERENCES).get(SCHEME)
+        if current_scheme is None or not current_scheme.startswith(TEMP_PATH):
+            sublime.error_message(MSGS["not_temp"])
+            return None
+        temp = join(sublime.packages_path(), "User", TEMP_FOLDER, basename(current_scheme))
+
+        if upstream is None:
+            for scheme in find_schemes():
+                if basename(scheme) == basename(current_scheme) and not scheme.startswith(TEMP_PATH):
+                    upstream = scheme
+                    break
+        if upstream is None:
+            sublime.error_message(MSGS["no_upstream"])
+            return None
+        return temp, temp + ".base", upstream
+
+
+class ColorSchemeDiffCommand(sublime_plugin.ApplicationCommand, ColorSchemeMergeBase):
+    def run(self, upstream=None):
+        sources = self.get_sources(upstream)
+        if sources is None:
+            return
+        temp, base, upstream = sources
+
+        try:
+            with open(temp, "rb") as f:
+                ours = f.read()
+            theirs = load_resource(upstream, binary=True)
+            if theirs is None:
+                raise IOError("Could not load %s" % upstream)
+            added, removed, changed = diff(ours, theirs)
+        except Exception as e:
+            print(e)
+            sublime.error_message(MSGS["diff"])
+            return
+
+        show_panel(
+            sublime.active_window(),
+            "color_scheme_merge",
+            format_diff("%s -> %s" % (basename(temp), upstream), added, removed, changed)
+        )
+
+
+class ColorSchemeMergeCommand(sublime_plugin.ApplicationCommand, ColorSchemeMergeBase):
+    def run(self, upstream=None):
+        sources = self.get_sources(upstream)
+        if sources is None:
+            return
+        temp, base, upstream = sources
+        if not exists(base):
+            sublime.error_message(MSGS["no_base"])
+            return
+
+        try:
+            with open(base, "rb") as f:
+                base_data = f.read()
+            with open(temp, "rb") as f:
+                ours = f.read()
+            theirs = load_resource(upstream, binary=True)
+            merged, conflicts = merge(base_data, ours, theirs)
+            with open(temp, "wb") as f:
+                f.write(merged)
+            # The upstream version is the base for the next merge
+            with open(base, "wb") as f:
+                f.write(theirs)
+        except Exception as e:
+            print(e)
+            sublime.error_message(MSGS["merge"])
+            return
+
+        show_panel(
+            sublime.active_window(),
+            "color_scheme_merge",
+            format_conflicts("Merged %s into %s" % (upstream, basename(temp)), conflicts)
+        )
 
 
 class GetColorSchemeFilesCommand(sublime_plugin.WindowCommand, PackageSearch):
@@ -198,11 +577,45 @@ class GetColorSchemeFilesCommand(sublime_plugin.WindowCommand, PackageSearch):
 
 class ColorSchemeEditorLogCommand(sublime_plugin.WindowCommand):
     def run(self):
-        log = join(sublime.packages_path(), "User", "subclrschm.log")
+        log = join(sublime.packages_path(), "User", LOG_FILE)
         if exists(log):
             self.window.open_file(log)
 
 
+class ColorSchemeEditorLogTailCommand(sublime_plugin.WindowCommand):
+    def follow(self, tail, view):
+        if LOG_TAIL is not tail or view.window() is None:
+            return
+        if ST3 and self.window.active_panel() != "output.color_scheme_log":
+            return
+        try:
+            text = tail.read_new()
+        except Exception as e:
+            print("ColorSchemeEditor: Could not read %s! (%s)" % (tail.path, str(e)))
+            return
+        if text:
+            append_panel(view, text)
+        sublime.set_timeout(lambda: self.follow(tail, view), 500)
+
+    def run(self, tail_kb=64, level=None, session="last"):
+        global LOG_TAIL
+        LOG_TAIL = LogTail(join(sublime.packages_path(), "User", LOG_FILE), tail_kb, level, session)
+        if ST3:
+            view = self.window.create_output_panel("color_scheme_log")
+        else:
+            view = self.window.get_output_panel("color_scheme_log")
+        append_panel(view, LOG_TAIL.read_initial())
+        self.window.run_command("show_panel", {"panel": "output.color_scheme_log"})
+        tail = LOG_TAIL
+        sublime.set_timeout(lambda: self.follow(tail, view), 500)
+
+
+class ColorSchemeEditorTraceSummaryCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        trace = join(sublime.packages_path(), "User", TRACE_FILE)
+        show_panel(self.window, "color_scheme_trace", summarize(read_trace(trace)))
+
+
 class ColorSchemeClearTempCommand(sublime_plugin.ApplicationCommand):
     def run(self):
         current_scheme = sublime.load_settings(PREFERENCES).get(SCHEME)
@@ -216,7 +629,8 @@ class ColorSchemeClearTempCommand(sublime_plugin.ApplicationCommand):
                     (
                         not using_temp or (
                             basename(pth) != basename(current_scheme) and
-                            basename(pth) != basename(current_scheme) + ".JSON"
+                            basename(pth) != basename(current_scheme) + ".JSON" and
+                            basename(pth) != basename(current_scheme) + ".base"
                         )
                     )
                 ):
@@ -231,8 +645,12 @@ class ColorSchemeEditorUpgradeCommand(sublime_plugin.ApplicationCommand):
             if sublime.ok_cancel_dialog(MSGS["download"]):
                 update_binary(init_plugin)
         else:
-            if not check_version(THEME_EDITOR, sublime.load_settings(PLUGIN_SETTINGS), init_plugin):
-                sublime.message_dialog(MSGS["no_updates"])
+            def on_done(update_available):
+                if not update_available:
+                    sublime.message_dialog(MSGS["no_updates"])
+
+            if not check_version_async(sublime.load_settings(PLUGIN_SETTINGS), init_plugin, True, on_done):
+                sublime.status_message(MSGS["checking"])
 
 
 def init_plugin():
@@ -241,6 +659,8 @@ def init_plugin():
     p_settings = sublime.load_settings(PLUGIN_SETTINGS)
     p_settings.clear_on_change('reload')
 
+    timing.configure(p_settings.get("trace", False), join(sublime.packages_path(), "User", TRACE_FILE))
+
     # Pick the correct binary for the editor
     THEME_EDITOR = get_binary_location()
 
@@ -250,7 +670,8 @@ def init_plugin():
         nix_check_permissions(THEME_EDITOR)
 
     if THEME_EDITOR is not None:
-        check_version(THEME_EDITOR, p_settings, init_plugin)
+        # Runs on a worker thread and only reports in the status bar
+        check_version_async(p_settings, init_plugin)
     else:
         if sublime.ok_cancel_dialog(MSGS["download"]):
             update_binary(init_plugin)
@@ -4,19 +4,29 @@ import sublime
 import shutil
 import tempfile
 import zipfile
-from os import remove, makedirs, rmdir, remove
+import hashlib
+import stat
+from os import remove, makedirs, rmdir, chmod, walk, rename
 from .file_strip.json import sanitize_json
 import json
-from os.path import join, exists, normpath, isdir
+from os.path import join, exists, normpath, isdir, relpath, getmtime
 import threading
+import time
 
 ST3 = int(sublime.version()) >= 3000
 if ST3:
     import urllib.request
+    import urllib.error
+    HTTPError = urllib.error.HTTPError
 else:
     import urllib2
+    HTTPError = urllib2.HTTPError
 LOCK = threading.Lock()
 UPDATING = False
+CHECKING = False
+LAST_CHECK = 0
+# Minimum seconds between two version checks of any kind
+MIN_CHECK_INTERVAL = 60
 PLUGIN_SETTINGS = 'color_scheme_editor.sublime-settings'
 BINARY_PATH = "${Packages}/User/subclrschm"
 BINARY = {
@@ -25,6 +35,8 @@ BINARY = {
     "linux": "subclrschm"
 }
 REPO = "https://github.com/facelessuser/subclrschm-bin/archive/%s.zip"
+MANIFEST = "subclrschm-bin-%s.manifest.json"
+UPDATE_CACHE = "subclrschm.update-check.json"
 MSGS = {
     "ignore_critical": '''Color Scheme Editor:
 You are currently running version %s of subclrschm, %s is the minimum expected version.  Some features may not work. Please consider updating the editor for the best possible experience.
@@ -60,6 +72,20 @@ subclrschm installed!
 
     "install_busy": '''Color Scheme Editor:
 Updater is currently busy attempting an install.
+''',
+
+    "install_current": '''Color Scheme Editor:
+subclrschm is already up to date.
+''',
+
+    "notify_upgrade": "Color Scheme Editor: subclrschm %s is available (run 'Color Scheme: Check for Editor Updates')",
+
+    "notify_critical": "Color Scheme Editor: subclrschm %s is older than the minimum expected version %s",
+
+    "notify_version": "Color Scheme Editor: There was a problem comparing subclrschm versions",
+
+    "install_verify": '''Color Scheme Editor:
+The downloaded subclrschm archive failed verification.  The installed version was left untouched.
 '''
 }
 
@@ -133,6 +159,49 @@ def get_binary_location():
     return join(parse_binary_path(), "subclrschm-bin-%s" % platform, BINARY[platform])
 
 
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_tree(root):
+    files = {}
+    for base, dirs, names in walk(root):
+        for name in names:
+            pth = join(base, name)
+            files[relpath(pth, root).replace("\\", "/")] = file_hash(pth)
+    return files
+
+
+def read_manifest(binpath):
+    manifest = join(binpath, MANIFEST % sublime.platform())
+    try:
+        with open(manifest, "r") as f:
+            return json.loads(f.read())
+    except Exception:
+        return None
+
+
+def write_manifest(binpath, manifest):
+    with open(join(binpath, MANIFEST % sublime.platform()), "w") as f:
+        f.write(json.dumps(manifest, indent=4, sort_keys=True))
+
+
+def install_intact(binpath, manifest):
+    """Check that every installed file still matches the hash recorded when it was installed."""
+
+    osbinpath = join(binpath, "subclrschm-bin-%s" % sublime.platform())
+    if manifest is None or not manifest.get("files") or not isdir(osbinpath):
+        return False
+    try:
+        return hash_tree(osbinpath) == manifest["files"]
+    except Exception:
+        return False
+
+
 def version_compare(version, min_version):
     cur_v = [int(x) for x in version.split('.')]
     min_v = [int(x) for x in min_version.split('.')]
@@ -170,9 +239,8 @@ def read_versions():
     return version, version_limits
 
 
-def check_version(editor, p_settings, upgrade_callback):
+def prompt_update(version, version_limits, p_settings, upgrade_callback):
     update_available = False
-    version, version_limits = read_versions()
 
     if version is not None and version_limits is not None:
         # True if versions are okay
@@ -191,7 +259,7 @@ def check_version(editor, p_settings, upgrade_callback):
             if sublime.ok_cancel_dialog(MSGS["upgrade"] % version_limits["max"], "Update"):
                 update_binary(upgrade_callback)
                 update_available = True
-            elif sublime.ok_cancel_dialog(MSGS["ignore_critical"], "Ignore"):
+            elif sublime.ok_cancel_dialog(MSGS["ignore"], "Ignore"):
                 p_settings.set("ignore_version_update", ignore_key)
                 sublime.save_settings(PLUGIN_SETTINGS)
     else:
@@ -199,6 +267,134 @@ def check_version(editor, p_settings, upgrade_callback):
     return update_available
 
 
+def notify_update(result, ignore_versions):
+    """Report the result of a background check in the status bar instead of a dialog."""
+
+    version = result["version"]
+    version_limits = result["limits"]
+    if version is None or version_limits is None:
+        sublime.status_message(MSGS["notify_version"])
+        return
+    if "%s:%s" % (version, version_limits["max"]) == ignore_versions:
+        return
+    if not version_compare(version, version_limits["min"]):
+        message = MSGS["notify_critical"] % (version, version_limits["min"])
+    elif not version_compare(version, version_limits["max"]):
+        message = MSGS["notify_upgrade"] % version_limits["max"]
+    else:
+        return
+    print(message)
+    sublime.status_message(message)
+
+
+def clear_update_cache():
+    cache = join(sublime.packages_path(), "User", UPDATE_CACHE)
+    try:
+        if exists(cache):
+            remove(cache)
+    except Exception as e:
+        print(e)
+
+
+def version_stamp():
+    """
+    Modification times of the installed binary's version.json and of the package's
+    version.json (or the package archive holding it).  A cached check is only valid
+    while these are unchanged.
+    """
+
+    installed = join(parse_binary_path(), "subclrschm-bin-%s" % sublime.platform(), "version.json")
+    package = join(sublime.packages_path(), "ColorSchemeEditor", "version.json")
+    if not exists(package):
+        package = join(sublime.installed_packages_path(), "ColorSchemeEditor.sublime-package")
+    return [getmtime(p) if exists(p) else None for p in (installed, package)]
+
+
+class CheckVersion(threading.Thread):
+    """
+    Read the installed and expected versions off the UI thread.
+    Results are cached in Packages/User for ttl seconds unless the check is forced
+    or either version file changed since.
+    """
+
+    def __init__(self, cache, ttl, force, on_done):
+        self.cache = cache
+        self.ttl = ttl
+        self.force = force
+        self.on_done = on_done
+        threading.Thread.__init__(self)
+
+    def read_cache(self, stamp):
+        try:
+            with open(self.cache, "r") as f:
+                result = json.loads(f.read())
+            if time.time() - float(result.get("checked", 0)) < self.ttl and result.get("stamp") == stamp:
+                return result
+        except Exception:
+            pass
+        return None
+
+    def write_cache(self, result):
+        try:
+            with open(self.cache, "w") as f:
+                f.write(json.dumps(result, indent=4, sort_keys=True))
+        except Exception as e:
+            print(e)
+
+    def run(self):
+        global CHECKING
+        result = None
+        try:
+            stamp = version_stamp()
+            if not self.force:
+                result = self.read_cache(stamp)
+            if result is None:
+                version, version_limits = read_versions()
+                result = {"checked": time.time(), "stamp": stamp, "version": version, "limits": version_limits}
+                if version is not None and version_limits is not None:
+                    self.write_cache(result)
+        except Exception as e:
+            print(e)
+            result = {"checked": time.time(), "version": None, "limits": None}
+        finally:
+            with LOCK:
+                CHECKING = False
+        sublime.set_timeout(lambda: self.on_done(result), 0)
+
+
+def check_version_async(p_settings, upgrade_callback, force=False, on_done=None):
+    """
+    Check the subclrschm version on a worker thread.
+    Automatic checks are rate limited, may use the cached result and only report
+    in the status bar.  Forced checks (the user asked) always re-read the versions
+    and prompt to update.  Returns False if the check was skipped.
+    """
+
+    global CHECKING
+    global LAST_CHECK
+    now = time.time()
+    with LOCK:
+        if CHECKING or (not force and now - LAST_CHECK < MIN_CHECK_INTERVAL):
+            return False
+        CHECKING = True
+        LAST_CHECK = now
+
+    ttl = float(p_settings.get("update_check_interval", 24)) * 3600
+    ignore_versions = str(p_settings.get("ignore_version_update", ""))
+    cache = join(sublime.packages_path(), "User", UPDATE_CACHE)
+
+    def report(result):
+        if force:
+            update_available = prompt_update(result["version"], result["limits"], p_settings, upgrade_callback)
+            if on_done is not None:
+                on_done(update_available)
+        else:
+            notify_update(result, ignore_versions)
+
+    CheckVersion(cache, ttl, force, report).start()
+    return True
+
+
 def update_binary(callback):
     with LOCK:
         updating = UPDATING
@@ -238,24 +434,25 @@ class MonitorThread():
         else:
             if self.thread.error_message is not None:
                 sublime.set_timeout(lambda: sublime.error_message(self.thread.error_message), 100)
+            elif self.thread.up_to_date:
+                sublime.set_timeout(lambda: sublime.message_dialog(MSGS["install_current"]), 100)
             else:
                 sublime.set_timeout(lambda: binary_upgraded(self.callback), 100)
 
 
 class GetBinary(threading.Thread):
     error_message = None
+    up_to_date = False
 
     def __init__(self):
         threading.Thread.__init__(self)
 
     def prepare_destination(self, binpath):
-        osbinpath = join(binpath, "subclrschm-bin-%s" % sublime.platform())
+        """Make sure the binary folder exists; the installed files are left alone until the swap."""
+
         try:
             if exists(binpath):
-                if isdir(binpath):
-                    if exists(osbinpath):
-                        shutil.rmtree(osbinpath, onerror=on_rm_error)
-                else:
+                if not isdir(binpath):
                     remove(binpath)
                     makedirs(binpath)
             else:
@@ -264,32 +461,146 @@ class GetBinary(threading.Thread):
             print(e)
             self.error_message = MSGS["install_directory"]
 
-    def download_file(self, url, destination):
-        if ST3:
-            with urllib.request.urlopen(url) as response:
+    def swap_install(self, staged, binpath):
+        """
+        Move the staged folder into place with renames on the same filesystem.
+        The previous install is kept as a backup until the new one is in place.
+        """
+
+        osbinpath = join(binpath, "subclrschm-bin-%s" % sublime.platform())
+        backup = osbinpath + ".old"
+        try:
+            if exists(backup):
+                shutil.rmtree(backup, onerror=on_rm_error)
+            if exists(osbinpath):
+                rename(osbinpath, backup)
+            try:
+                rename(staged, osbinpath)
+            except Exception:
+                if exists(backup) and not exists(osbinpath):
+                    rename(backup, osbinpath)
+                raise
+        except Exception as e:
+            print(e)
+            self.error_message = MSGS["install_directory"]
+            return False
+
+        try:
+            if exists(backup):
+                shutil.rmtree(backup, onerror=on_rm_error)
+        except Exception as e:
+            print("ColorSchemeEditor: Could not remove %s! (%s)" % (backup, str(e)))
+        return True
+
+    def download_file(self, url, destination, headers=None):
+        """
+        Download url to destination.  Returns (modified, etag, last modified);
+        modified is False if the server answered a conditional request with 304.
+        """
+
+        try:
+            if ST3:
+                req = urllib.request.Request(url, headers=headers or {})
+                with urllib.request.urlopen(req) as response:
+                    with open(destination, 'wb') as out_file:
+                        shutil.copyfileobj(response, out_file)
+                    info = response.info()
+            else:
+                req = urllib2.Request(url, headers=headers or {})
+                response = urllib2.urlopen(req)
                 with open(destination, 'wb') as out_file:
                     shutil.copyfileobj(response, out_file)
-        else:
-            req = urllib2.Request(url)
-            response = urllib2.urlopen(req)
-            with open(destination, 'wb') as out_file:
-                shutil.copyfileobj(response, out_file)
-            response.close()
+                info = response.info()
+                response.close()
+        except HTTPError as e:
+            if e.code == 304:
+                return False, None, None
+            raise
+        return True, info.get("ETag"), info.get("Last-Modified")
+
+    def verify_archive(self, file_name, extract_path):
+        """Extract the archive to a staging folder and make sure it contains a usable binary."""
+
+        platform = sublime.platform()
+        try:
+            if ST3:
+                with zipfile.ZipFile(file_name) as z:
+                    bad = z.testzip()
+            else:
+                z = zipfile.ZipFile(file_name)
+                bad = z.testzip()
+                z.close()
+        except zipfile.BadZipfile as e:
+            print("ColorSchemeEditor: Invalid subclrschm archive! (%s)" % str(e))
+            return None
+        if bad is not None:
+            print("ColorSchemeEditor: Corrupt file %s in subclrschm archive!" % bad)
+            return None
+        unzip(file_name, extract_path)
+        staged = join(extract_path, "subclrschm-bin-%s" % platform)
+        if not exists(join(staged, BINARY[platform])):
+            print("ColorSchemeEditor: subclrschm archive does not contain %s!" % BINARY[platform])
+            return None
+        return staged
 
     def get_binary(self):
         binpath = parse_binary_path()
+        manifest = read_manifest(binpath)
+        intact = install_intact(binpath, manifest)
+
+        # Only ask for the archive if it changed since the intact install
+        headers = {}
+        if intact:
+            if manifest.get("etag"):
+                headers["If-None-Match"] = manifest["etag"]
+            if manifest.get("last_modified"):
+                headers["If-Modified-Since"] = manifest["last_modified"]
+
         self.prepare_destination(binpath)
-        if self.error_message is None:
-            try:
-                temp = tempfile.mkdtemp(prefix="subclrschm")
-                file_name = join(temp, "subclrschm.zip")
-                self.download_file(REPO % sublime.platform(), file_name)
-                unzip(file_name, binpath)
-                if exists(temp):
-                    shutil.rmtree(temp, onerror=on_rm_error)
-            except Exception as e:
-                print(e)
-                self.error_message = MSGS["install_download"]
+        if self.error_message is not None:
+            return
+
+        # Stage next to the install so the swap is a rename, not a copy across filesystems
+        temp = tempfile.mkdtemp(prefix="subclrschm-staging", dir=binpath)
+        try:
+            file_name = join(temp, "subclrschm.zip")
+            modified, etag, last_modified = self.download_file(REPO % sublime.platform(), file_name, headers)
+            if not modified:
+                self.up_to_date = True
+                return
+
+            archive = file_hash(file_name)
+            if intact and archive == manifest.get("archive"):
+                manifest["etag"] = etag
+                manifest["last_modified"] = last_modified
+                write_manifest(binpath, manifest)
+                self.up_to_date = True
+                return
+
+            staged = self.verify_archive(file_name, join(temp, "extract"))
+            if staged is None:
+                self.error_message = MSGS["install_verify"]
+                return
+            files = hash_tree(staged)
+
+            # Swap the verified files in
+            if not self.swap_install(staged, binpath):
+                return
+            write_manifest(
+                binpath,
+                {
+                    "archive": archive,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "files": files
+                }
+            )
+        except Exception as e:
+            print(e)
+            self.error_message = MSGS["install_download"]
+        finally:
+            if exists(temp):
+                shutil.rmtree(temp, onerror=on_rm_error)
 
     def run(self):
         global UPDATING
@@ -301,6 +612,7 @@ class GetBinary(threading.Thread):
 
 
 def binary_upgraded(callback):
+    clear_update_cache()
     sublime.message_dialog(MSGS["install_success"])
     callback()
 
@@ -0,0 +1,17 @@
+"""
+Color Scheme Editor size capped file rotation
+Licensed under MIT
+Copyright (c) 2013 Isaac Muse <isaacmuse@gmail.com>
+"""
+from os import remove, rename
+from os.path import exists, getsize
+
+
+def rotate(path, max_size):
+    """Move a file to a single .1 backup once it reaches max_size bytes."""
+
+    if exists(path) and getsize(path) >= max_size:
+        backup = path + ".1"
+        if exists(backup):
+            remove(backup)
+        rename(path, backup)
@@ -0,0 +1,109 @@
+"""
+Color Scheme Editor log tailing
+Licensed under MIT
+Copyright (c) 2013 Isaac Muse <isaacmuse@gmail.com>
+"""
+import re
+import time
+from os.path import exists, getsize
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+RE_LEVEL = re.compile(r"\b(DEBUG|INFO|WARNING|ERROR|CRITICAL)\b")
+SESSION_MARKER = "=== ColorSchemeEditor session %d ===\n"
+RE_SESSION = re.compile(r"^=== ColorSchemeEditor session (\d+) ===")
+LAST_SESSION = 0
+
+
+def start_session(path):
+    """Append a session marker so the viewer can tell editor launches apart."""
+
+    global LAST_SESSION
+    # Milliseconds, bumped if needed so every launch gets its own id
+    session = max(int(time.time() * 1000), LAST_SESSION + 1)
+    LAST_SESSION = session
+    with open(path, "a") as f:
+        f.write(SESSION_MARKER % session)
+    return session
+
+
+class LogTail(object):
+    """
+    Read the end of a log and then only what gets appended to it.
+    Lines are filtered by minimum level and by session; lines without a level
+    (tracebacks etc.) inherit the level of the line before them.
+    """
+
+    def __init__(self, path, tail_kb=64, level=None, session="last"):
+        self.path = path
+        self.tail = int(tail_kb) * 1024
+        self.min_level = LEVELS.index(level.upper()) if level is not None and level.upper() in LEVELS else 0
+        self.follow_last = session == "last"
+        self.session = None if session is None or self.follow_last else int(session)
+        self.offset = 0
+        self.partial = b""
+        self.current_level = 0
+        self.current_session = None
+
+    def read_chunk(self, start, end):
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def split(self, data):
+        data = self.partial + data
+        idx = data.rfind(b"\n")
+        if idx == -1:
+            self.partial = data
+            return []
+        self.partial = data[idx + 1:]
+        return data[:idx + 1].decode("utf-8", "replace").splitlines(True)
+
+    def filter(self, lines, initial=False):
+        out = []
+        for line in lines:
+            m = RE_SESSION.match(line)
+            if m is not None:
+                self.current_session = int(m.group(1))
+                if self.follow_last:
+                    # Only the newest session is wanted, so drop what came before it
+                    self.session = self.current_session
+                    if initial:
+                        out = []
+                if self.session is None or self.current_session == self.session:
+                    out.append(line)
+                continue
+            m = RE_LEVEL.search(line)
+            if m is not None:
+                self.current_level = LEVELS.index(m.group(1))
+            if self.current_level < self.min_level:
+                continue
+            if self.session is not None and self.current_session != self.session:
+                continue
+            out.append(line)
+        return "".join(out)
+
+    def read_initial(self):
+        if not exists(self.path):
+            return ""
+        size = getsize(self.path)
+        start = max(0, size - self.tail)
+        lines = self.split(self.read_chunk(start, size))
+        if start > 0 and lines:
+            # Drop the line the seek landed in the middle of
+            lines = lines[1:]
+        self.offset = size
+        return self.filter(lines, True)
+
+    def read_new(self):
+        if not exists(self.path):
+            return ""
+        size = getsize(self.path)
+        if size < self.offset:
+            # Log was rotated or truncated
+            self.offset = 0
+            self.partial = b""
+        if size == self.offset:
+            return ""
+        data = self.read_chunk(self.offset, size)
+        self.offset = size
+        return self.filter(self.split(data))
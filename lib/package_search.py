@@ -9,6 +9,7 @@ from os import walk, listdir
 from os.path import basename, dirname, isdir, join, normpath
 from fnmatch import fnmatch
 import zipfile
+from .timing import span
 
 ST3 = int(sublime.version()) >= 3000
 if ST3:
@@ -94,10 +95,11 @@ if ST3:
             regex = kwargs.get("regex", False)
             self.find_all = kwargs.get("find_all", False)
 
-            if not self.find_all:
-                self.find(pattern, regex)
-            else:
-                self.find_raw(pattern, regex)
+            with span("package_search.search"):
+                if not self.find_all:
+                    self.find(pattern, regex)
+                else:
+                    self.find_raw(pattern, regex)
 else:
     class PackageSearch(object):
         def pre_process(self, **kwargs):
@@ -145,4 +147,5 @@ else:
             regex = kwargs.get("regex", False)
             deep_search = kwargs.get("deep_search", True)
 
-            self.find(pattern, deep_search, regex)
+            with span("package_search.search"):
+                self.find(pattern, deep_search, regex)
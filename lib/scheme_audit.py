@@ -0,0 +1,114 @@
+"""
+Color Scheme Editor contrast audit
+Licensed under MIT
+Copyright (c) 2013 Isaac Muse <isaacmuse@gmail.com>
+"""
+from array import array
+from .scheme_colors import RE_COLOR, parse_hex, composite, contrast_ratios
+from .scheme_rules import parse_scheme
+
+# Global foreground settings and the background they are drawn over
+GLOBAL_PAIRS = (
+    ("foreground", "background"),
+    ("caret", "background"),
+    ("invisibles", "background"),
+    ("gutterForeground", "gutter"),
+    ("selectionForeground", "selection"),
+    ("findHighlightForeground", "findHighlight")
+)
+LEVELS = ((7.0, "AAA"), (4.5, "AA"), (3.0, "AA Large"))
+SORT_KEYS = ("ratio", "scope", "order")
+DEFAULT_BG = "#FFFFFF"
+DEFAULT_FG = "#000000"
+
+# Results of previous audits: {scheme: {pair key: ratio}}
+AUDIT_CACHE = {}
+
+
+def color(value, fallback):
+    value = value.strip() if hasattr(value, "strip") else None
+    if value is None or RE_COLOR.match("<string>%s</string>" % value) is None:
+        value = fallback
+    return parse_hex(value)
+
+
+def level(ratio):
+    for minimum, name in LEVELS:
+        if ratio >= minimum:
+            return name
+    return "Fail"
+
+
+def collect_pairs(global_settings, rules):
+    """Return (key, label, foreground, background) for every color pair in the scheme."""
+
+    pairs = []
+    background = composite(color(global_settings.get("background"), DEFAULT_BG), parse_hex(DEFAULT_BG))
+    foreground = color(global_settings.get("foreground"), DEFAULT_FG)
+
+    for fg_key, bg_key in GLOBAL_PAIRS:
+        if fg_key not in global_settings:
+            continue
+        bg = background
+        if bg_key != "background" and bg_key in global_settings:
+            bg = composite(color(global_settings.get(bg_key), DEFAULT_BG), background)
+        fg = color(global_settings.get(fg_key), DEFAULT_FG)
+        pairs.append((("global", fg_key, fg, bg), "<global> %s" % fg_key, fg, bg))
+
+    for rule in rules:
+        settings = rule["settings"]
+        if "foreground" not in settings and "background" not in settings:
+            continue
+        bg = background
+        if "background" in settings:
+            bg = composite(color(settings.get("background"), DEFAULT_BG), background)
+        fg = color(settings.get("foreground"), DEFAULT_FG) if "foreground" in settings else foreground
+        label = "%s [%s]" % (rule["scope"], rule["name"]) if rule["name"] else rule["scope"]
+        pairs.append(((rule["scope"], rule["name"], fg, bg), label, fg, bg))
+    return pairs
+
+
+def audit(scheme, data):
+    """
+    Audit every foreground/background pair of a scheme.
+    Pairs seen in the previous audit of the same scheme are reused,
+    so only new or changed rules are recomputed.
+    """
+
+    global_settings, rules = parse_scheme(data)[1:]
+    pairs = collect_pairs(global_settings, rules)
+    cache = AUDIT_CACHE.get(scheme, {})
+
+    missing = [p for p in pairs if p[0] not in cache]
+    fg = array('d')
+    bg = array('d')
+    for p in missing:
+        fg.extend(p[2])
+        bg.extend(p[3])
+    computed = dict(zip([p[0] for p in missing], contrast_ratios(fg, bg)))
+
+    results = []
+    fresh = {}
+    for order, p in enumerate(pairs):
+        ratio = cache[p[0]] if p[0] in cache else computed[p[0]]
+        fresh[p[0]] = ratio
+        results.append(
+            {
+                "order": order,
+                "scope": p[1],
+                "ratio": ratio,
+                "level": level(ratio)
+            }
+        )
+    AUDIT_CACHE[scheme] = fresh
+    return results, len(missing)
+
+
+def format_results(scheme, results, sort="ratio"):
+    if sort not in SORT_KEYS:
+        sort = "ratio"
+    lines = ["%s" % scheme, "-" * len(scheme)]
+    for r in sorted(results, key=lambda x: (x[sort], x["order"])):
+        lines.append("%6.2f:1  %-8s  %s" % (r["ratio"], r["level"], r["scope"]))
+    lines.append("")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,287 @@
+"""
+Color Scheme Editor bulk color transforms
+Licensed under MIT
+Copyright (c) 2013 Isaac Muse <isaacmuse@gmail.com>
+"""
+import re
+import colorsys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RE_COLOR = re.compile(
+    r'(<string>\s*)#([0-9a-fA-F]{8}|[0-9a-fA-F]{6}|[0-9a-fA-F]{3})(\s*</string>)'
+)
+CHANNELS = 4
+OPERATIONS = ("hue", "saturation", "lightness", "remap")
+
+
+def parse_hex(value):
+    value = value.lstrip("#")
+    if len(value) == 3:
+        value = "".join([c * 2 for c in value])
+    if len(value) == 6:
+        value += "FF"
+    return (
+        int(value[0:2], 16) / 255.0,
+        int(value[2:4], 16) / 255.0,
+        int(value[4:6], 16) / 255.0,
+        int(value[6:8], 16) / 255.0
+    )
+
+
+def to_byte(value):
+    return int(round(min(max(value, 0.0), 1.0) * 255))
+
+
+def format_hex(r, g, b, a=None, upper=True):
+    if a is None:
+        value = "#%02x%02x%02x" % (to_byte(r), to_byte(g), to_byte(b))
+    else:
+        value = "#%02x%02x%02x%02x" % (to_byte(r), to_byte(g), to_byte(b), to_byte(a))
+    return value.upper() if upper else value
+
+
+def rgb_key(r, g, b):
+    return (to_byte(r) << 16) | (to_byte(g) << 8) | to_byte(b)
+
+
+def parse_palette(palette):
+    """
+    Accept either a dict of {"#from": "#to"} or a string of
+    "#from:#to, #from:#to" pairs and return {0xRRGGBB: (r, g, b)}.
+    """
+
+    mapping = {}
+    if palette is None:
+        return mapping
+    if not isinstance(palette, dict):
+        pairs = {}
+        for entry in str(palette).split(","):
+            if ":" in entry:
+                src, dst = entry.split(":", 1)
+                pairs[src.strip()] = dst.strip()
+        palette = pairs
+    for src, dst in palette.items():
+        s = parse_hex(src)
+        mapping[rgb_key(s[0], s[1], s[2])] = parse_hex(dst)[0:3]
+    return mapping
+
+
+class SchemeColors(object):
+    """
+    All hex colors of a tmTheme packed into a flat RGBA array of floats.
+    Only the color strings are rewritten, so the rest of the file is left untouched.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.spans = []
+        self.formats = []
+        values = []
+        for m in RE_COLOR.finditer(text):
+            value = m.group(2)
+            self.spans.append((m.start(2) - 1, m.end(2)))
+            self.formats.append((len(value) == 8, value.upper() == value))
+            values.extend(parse_hex(value))
+        self.colors = array('d', values)
+
+    def __len__(self):
+        return len(self.spans)
+
+    def transform(self, operation, amount=None, palette=None):
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown transform '%s'" % operation)
+        if not len(self):
+            return
+        if operation == "remap":
+            mapping = parse_palette(palette)
+            if numpy is not None:
+                self.colors = _np_remap(self.colors, mapping)
+            else:
+                self.colors = _py_remap(self.colors, mapping)
+        else:
+            if numpy is not None:
+                self.colors = _np_hls(self.colors, operation, float(amount))
+            else:
+                self.colors = _py_hls(self.colors, operation, float(amount))
+
+    def apply(self):
+        colors = self.colors
+        out = []
+        last = 0
+        for i in range(len(self.spans)):
+            start, end = self.spans[i]
+            alpha, upper = self.formats[i]
+            idx = i * CHANNELS
+            out.append(self.text[last:start])
+            out.append(
+                format_hex(
+                    colors[idx], colors[idx + 1], colors[idx + 2],
+                    colors[idx + 3] if alpha else None,
+                    upper
+                )
+            )
+            last = end
+        out.append(self.text[last:])
+        self.text = "".join(out)
+        return self.text
+
+
+def _adjust_hls(h, l, s, operation, amount):
+    if operation == "hue":
+        h = (h + amount / 360.0) % 1.0
+    elif operation == "saturation":
+        s = min(max(s * amount, 0.0), 1.0)
+    elif operation == "lightness":
+        l = min(max(l + amount, 0.0), 1.0)
+    return h, l, s
+
+
+def _py_hls(colors, operation, amount):
+    out = array('d', colors)
+    for idx in range(0, len(out), CHANNELS):
+        h, l, s = colorsys.rgb_to_hls(out[idx], out[idx + 1], out[idx + 2])
+        h, l, s = _adjust_hls(h, l, s, operation, amount)
+        out[idx], out[idx + 1], out[idx + 2] = colorsys.hls_to_rgb(h, l, s)
+    return out
+
+
+def _py_remap(colors, mapping):
+    out = array('d', colors)
+    for idx in range(0, len(out), CHANNELS):
+        target = mapping.get(rgb_key(out[idx], out[idx + 1], out[idx + 2]))
+        if target is not None:
+            out[idx], out[idx + 1], out[idx + 2] = target
+    return out
+
+
+def _np_unpack(colors):
+    return numpy.frombuffer(colors, dtype=numpy.float64).reshape(-1, CHANNELS).copy()
+
+
+def _np_pack(rgba):
+    return array('d', numpy.ascontiguousarray(rgba, dtype=numpy.float64).tobytes())
+
+
+def _np_hue_channel(m1, m2, hue):
+    hue = hue % 1.0
+    return numpy.where(
+        hue < 1.0 / 6.0, m1 + (m2 - m1) * hue * 6.0,
+        numpy.where(
+            hue < 0.5, m2,
+            numpy.where(hue < 2.0 / 3.0, m1 + (m2 - m1) * (2.0 / 3.0 - hue) * 6.0, m1)
+        )
+    )
+
+
+def _np_hls(colors, operation, amount):
+    rgba = _np_unpack(colors)
+    r, g, b = rgba[:, 0], rgba[:, 1], rgba[:, 2]
+
+    # Vectorized equivalent of colorsys.rgb_to_hls
+    maxc = rgba[:, 0:3].max(1)
+    minc = rgba[:, 0:3].min(1)
+    l = (maxc + minc) / 2.0
+    delta = maxc - minc
+    grey = delta == 0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        s = numpy.where(l <= 0.5, delta / (maxc + minc), delta / (2.0 - maxc - minc))
+        rc = (maxc - r) / delta
+        gc = (maxc - g) / delta
+        bc = (maxc - b) / delta
+    h = numpy.where(r == maxc, bc - gc, numpy.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = (h / 6.0) % 1.0
+    h[grey] = 0.0
+    s[grey] = 0.0
+
+    if operation == "hue":
+        h = (h + amount / 360.0) % 1.0
+    elif operation == "saturation":
+        s = numpy.clip(s * amount, 0.0, 1.0)
+    elif operation == "lightness":
+        l = numpy.clip(l + amount, 0.0, 1.0)
+
+    # Vectorized equivalent of colorsys.hls_to_rgb
+    m2 = numpy.where(l <= 0.5, l * (1.0 + s), l + s - (l * s))
+    m1 = 2.0 * l - m2
+    grey = s == 0
+    rgba[:, 0] = numpy.where(grey, l, _np_hue_channel(m1, m2, h + 1.0 / 3.0))
+    rgba[:, 1] = numpy.where(grey, l, _np_hue_channel(m1, m2, h))
+    rgba[:, 2] = numpy.where(grey, l, _np_hue_channel(m1, m2, h - 1.0 / 3.0))
+    return _np_pack(rgba)
+
+
+def _np_remap(colors, mapping):
+    if not mapping:
+        return colors
+    rgba = _np_unpack(colors)
+    rgb = numpy.clip(numpy.round(rgba[:, 0:3] * 255), 0, 255).astype(numpy.int64)
+    keys = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+    src = numpy.array(sorted(mapping.keys()), dtype=numpy.int64)
+    dst = numpy.array([mapping[k] for k in sorted(mapping.keys())], dtype=numpy.float64)
+    idx = numpy.clip(numpy.searchsorted(src, keys), 0, len(src) - 1)
+    hit = src[idx] == keys
+    rgba[hit, 0:3] = dst[idx[hit]]
+    return _np_pack(rgba)
+
+
+def _linear(c):
+    return c / 12.92 if c <= 0.03928 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def _py_contrast(fg, bg):
+    ratios = []
+    for idx in range(0, len(fg), CHANNELS):
+        a = fg[idx + 3]
+        lum = []
+        for rgb in (
+            [fg[idx + i] * a + bg[idx + i] * (1.0 - a) for i in range(3)],
+            [bg[idx + i] for i in range(3)]
+        ):
+            lum.append(0.2126 * _linear(rgb[0]) + 0.7152 * _linear(rgb[1]) + 0.0722 * _linear(rgb[2]))
+        ratios.append((max(lum) + 0.05) / (min(lum) + 0.05))
+    return ratios
+
+
+def _np_contrast(fg, bg):
+    fg = _np_unpack(fg)
+    bg = _np_unpack(bg)
+    a = fg[:, 3:4]
+    fg_rgb = fg[:, 0:3] * a + bg[:, 0:3] * (1.0 - a)
+    weights = numpy.array([0.2126, 0.7152, 0.0722])
+    lum = []
+    for rgb in (fg_rgb, bg[:, 0:3]):
+        linear = numpy.where(rgb <= 0.03928, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+        lum.append(linear.dot(weights))
+    hi = numpy.maximum(lum[0], lum[1])
+    lo = numpy.minimum(lum[0], lum[1])
+    return ((hi + 0.05) / (lo + 0.05)).tolist()
+
+
+def composite(fg, bg):
+    """Flatten an RGBA color tuple over an opaque background color tuple."""
+
+    a = fg[3]
+    return (
+        fg[0] * a + bg[0] * (1.0 - a),
+        fg[1] * a + bg[1] * (1.0 - a),
+        fg[2] * a + bg[2] * (1.0 - a),
+        1.0
+    )
+
+
+def contrast_ratios(fg, bg):
+    """
+    WCAG contrast ratio for each pair of packed RGBA colors.
+    Foreground alpha is composited over the background; backgrounds are treated as opaque.
+    """
+
+    if not len(fg):
+        return []
+    if numpy is not None:
+        return _np_contrast(fg, bg)
+    return _py_contrast(fg, bg)
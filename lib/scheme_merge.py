@@ -0,0 +1,198 @@
+"""
+Color Scheme Editor scheme diff and three-way merge
+Licensed under MIT
+Copyright (c) 2013 Isaac Muse <isaacmuse@gmail.com>
+"""
+import plistlib
+from .scheme_rules import read_plist, rule_key
+
+GLOBAL_KEY = "<global>"
+
+
+def write_plist(plist):
+    if hasattr(plistlib, "dumps"):
+        return plistlib.dumps(plist)
+    if hasattr(plistlib, "writePlistToBytes"):
+        return plistlib.writePlistToBytes(plist)
+    return plistlib.writePlistToString(plist)
+
+
+def keyed_entries(plist):
+    """
+    Key every entry of the settings array by normalized scope and name.
+    Duplicate keys get an occurrence suffix so each entry stays addressable.
+    Returns the keys in order and a dict of key to entry.
+    """
+
+    order = []
+    entries = {}
+    seen = {}
+    for entry in plist.get("settings", []):
+        if not isinstance(entry, dict):
+            continue
+        key = GLOBAL_KEY if entry.get("scope") is None else rule_key(entry)
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        if count:
+            key = "%s#%d" % (key, count)
+        order.append(key)
+        entries[key] = entry
+    return order, entries
+
+
+def diff(old_data, new_data):
+    """Report added, removed and changed entries between two schemes."""
+
+    old_order, old = keyed_entries(read_plist(old_data))
+    new_order, new = keyed_entries(read_plist(new_data))
+
+    added = [k for k in new_order if k not in old]
+    removed = [k for k in old_order if k not in new]
+    changed = []
+    for key in new_order:
+        if key not in old:
+            continue
+        a = old[key].get("settings", {})
+        b = new[key].get("settings", {})
+        for setting in sorted(set(a.keys()) | set(b.keys())):
+            if a.get(setting) != b.get(setting):
+                changed.append((key, setting, a.get(setting), b.get(setting)))
+    return added, removed, changed
+
+
+def merge_values(base, ours, theirs, key, conflicts):
+    """
+    Three-way merge of two dicts of plain values.
+    Conflicting values keep ours and are recorded in conflicts.
+    """
+
+    merged = {}
+    for name in set(base.keys()) | set(ours.keys()) | set(theirs.keys()):
+        b = base.get(name)
+        o = ours.get(name)
+        t = theirs.get(name)
+        if o == t or t == b:
+            value = o
+        elif o == b:
+            value = t
+        else:
+            value = o
+            conflicts.append((key, name, o, t))
+        if value is not None:
+            merged[name] = value
+    return merged
+
+
+def merge_entry(base, ours, theirs, key, conflicts):
+    merged = merge_values(
+        dict([(k, v) for k, v in base.items() if k != "settings"]),
+        dict([(k, v) for k, v in ours.items() if k != "settings"]),
+        dict([(k, v) for k, v in theirs.items() if k != "settings"]),
+        key,
+        conflicts
+    )
+    merged["settings"] = merge_values(
+        base.get("settings", {}), ours.get("settings", {}), theirs.get("settings", {}), key, conflicts
+    )
+    return merged
+
+
+def merge(base_data, ours_data, theirs_data):
+    """
+    Three-way merge a customized scheme (ours) onto a newer upstream scheme (theirs)
+    using the upstream version the customization started from (base).
+    Upstream order is kept; local additions follow the entry they followed locally.
+    Returns the merged plist data and a list of (key, setting, ours, theirs) conflicts.
+    """
+
+    base_plist = read_plist(base_data)
+    ours_plist = read_plist(ours_data)
+    theirs_plist = read_plist(theirs_data)
+    base = keyed_entries(base_plist)[1]
+    ours_order, ours = keyed_entries(ours_plist)
+    theirs_order, theirs = keyed_entries(theirs_plist)
+    conflicts = []
+
+    merged = {}
+    for key in theirs_order:
+        if key in ours:
+            merged[key] = merge_entry(base.get(key, {}), ours[key], theirs[key], key, conflicts)
+        elif key not in base:
+            merged[key] = theirs[key]
+        elif theirs[key] != base[key]:
+            # Removed locally but changed upstream
+            merged[key] = theirs[key]
+            conflicts.append((key, None, None, "changed upstream"))
+    for key in ours_order:
+        if key in theirs:
+            continue
+        if key not in base:
+            merged[key] = ours[key]
+        elif ours[key] != base[key]:
+            # Removed upstream but changed locally
+            merged[key] = ours[key]
+            conflicts.append((key, None, "changed locally", None))
+
+    # Anchor local-only entries after the entry that preceded them locally
+    anchored = {}
+    last = None
+    for key in ours_order:
+        if key not in merged:
+            continue
+        if key not in theirs:
+            anchored.setdefault(last, []).append(key)
+        last = key
+
+    order = []
+
+    def emit(anchor):
+        stack = list(reversed(anchored.pop(anchor, [])))
+        while stack:
+            key = stack.pop()
+            order.append(key)
+            stack.extend(reversed(anchored.pop(key, [])))
+
+    emit(None)
+    for key in theirs_order:
+        if key in merged:
+            order.append(key)
+            emit(key)
+    for anchor in list(anchored.keys()):
+        emit(anchor)
+
+    plist = merge_values(
+        dict([(k, v) for k, v in base_plist.items() if k != "settings"]),
+        dict([(k, v) for k, v in ours_plist.items() if k != "settings"]),
+        dict([(k, v) for k, v in theirs_plist.items() if k != "settings"]),
+        "<scheme>",
+        conflicts
+    )
+    plist["settings"] = [merged[k] for k in order]
+    return write_plist(plist), conflicts
+
+
+def format_diff(title, added, removed, changed):
+    lines = [title, "-" * len(title)]
+    for key in added:
+        lines.append("+ %s" % key)
+    for key in removed:
+        lines.append("- %s" % key)
+    for key, setting, old, new in changed:
+        lines.append("~ %s: %s %s -> %s" % (key, setting, old, new))
+    if len(lines) == 2:
+        lines.append("No differences")
+    lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def format_conflicts(title, conflicts):
+    lines = [title, "-" * len(title)]
+    for key, setting, ours, theirs in conflicts:
+        if setting is None:
+            lines.append("! %s: kept (%s)" % (key, ours if ours is not None else theirs))
+        else:
+            lines.append("! %s: %s kept %s over upstream %s" % (key, setting, ours, theirs))
+    if len(lines) == 2:
+        lines.append("Merged without conflicts")
+    lines.append("")
+    return "\n".join(lines) + "\n"
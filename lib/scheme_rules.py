@@ -0,0 +1,70 @@
+"""
+Color Scheme Editor tmTheme rule parsing
+Licensed under MIT
+Copyright (c) 2013 Isaac Muse <isaacmuse@gmail.com>
+"""
+import re
+import plistlib
+
+RE_SPACE = re.compile(r"\s+")
+RE_SCOPE_KEY = re.compile(r"<key>\s*scope\s*</key>")
+
+
+def read_plist(data):
+    if isinstance(data, type(u"")):
+        data = data.encode("utf-8")
+    if hasattr(plistlib, "loads"):
+        return plistlib.loads(data)
+    if hasattr(plistlib, "readPlistFromBytes"):
+        return plistlib.readPlistFromBytes(data)
+    return plistlib.readPlistFromString(data)
+
+
+def normalize_scope(scope):
+    selectors = [RE_SPACE.sub(" ", s.strip()) for s in scope.split(",")]
+    return ", ".join(sorted([s for s in selectors if s]))
+
+
+def rule_key(rule):
+    return "%s|%s" % (normalize_scope(rule.get("scope", "")), rule.get("name", ""))
+
+
+def parse_scheme(data):
+    """
+    Split a tmTheme into its global settings and its scope rules.
+    Rules keep their original order; entries without a scope are treated as global.
+    """
+
+    plist = read_plist(data)
+    global_settings = {}
+    rules = []
+    for entry in plist.get("settings", []):
+        if not isinstance(entry, dict):
+            continue
+        settings = entry.get("settings", {})
+        if entry.get("scope") is None:
+            global_settings.update(settings)
+        else:
+            rules.append(
+                {
+                    "name": entry.get("name", ""),
+                    "scope": entry.get("scope", ""),
+                    "settings": settings
+                }
+            )
+    return plist, global_settings, rules
+
+
+def rule_lines(text):
+    """Line number (1 based) of each rule's scope key in the order the rules are parsed."""
+
+    if not isinstance(text, type(u"")):
+        text = text.decode("utf-8")
+    lines = []
+    line = 1
+    last = 0
+    for m in RE_SCOPE_KEY.finditer(text):
+        line += text.count("\n", last, m.start())
+        last = m.start()
+        lines.append(line)
+    return lines
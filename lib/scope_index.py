@@ -0,0 +1,264 @@
+"""
+Color Scheme Editor scope selector index
+Licensed under MIT
+Copyright (c) 2013 Isaac Muse <isaacmuse@gmail.com>
+"""
+import re
+import time
+
+RE_EXCLUDE = re.compile(r"\s+-\s*|^-\s*")
+RE_UNSUPPORTED = re.compile(r"[&>]")
+CACHE_SIZE = 1024
+
+
+def split_top(text, separators):
+    """Split text on any of the separator characters that are not inside parentheses."""
+
+    parts = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(text):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth < 0:
+                raise ValueError("Unbalanced parentheses")
+        elif depth == 0 and c in separators:
+            parts.append(text[start:i])
+            start = i + 1
+    if depth:
+        raise ValueError("Unbalanced parentheses")
+    parts.append(text[start:])
+    return parts
+
+
+def split_exclusions(text):
+    """Split a selector on exclusion operators that are not inside parentheses."""
+
+    parts = []
+    start = 0
+    for m in RE_EXCLUDE.finditer(text):
+        depth = text.count("(", 0, m.start()) - text.count(")", 0, m.start())
+        if depth:
+            raise ValueError("Exclusions inside groups are not supported")
+        parts.append(text[start:m.start()])
+        start = m.end()
+    parts.append(text[start:])
+    return parts
+
+
+def expand_groups(text):
+    """
+    Expand grouped alternatives into plain descendant selectors:
+    "a (b | c)" becomes ["a b", "a c"].
+    """
+
+    alternatives = []
+    for alt in split_top(text, "|,"):
+        results = [""]
+        i = 0
+        while i < len(alt):
+            if alt[i] == "(":
+                depth = 1
+                j = i + 1
+                while depth:
+                    if alt[j] == "(":
+                        depth += 1
+                    elif alt[j] == ")":
+                        depth -= 1
+                    j += 1
+                inner = expand_groups(alt[i + 1:j - 1])
+                results = [r + " " + x + " " for r in results for x in inner]
+                i = j
+            else:
+                results = [r + alt[i] for r in results]
+                i += 1
+        alternatives.extend([" ".join(r.split()) for r in results])
+    return [a for a in alternatives if a]
+
+
+def parse_selector(selector):
+    """
+    Parse one comma separated scope selector into a list of (path, exclusions).
+    Grouped alternatives yield one path each; exclusions apply to all of them.
+    Each path is a list of components, and each component a tuple of dotted atoms.
+    Raises ValueError for selectors that cannot be represented (& and > operators,
+    exclusions inside groups, unbalanced parentheses).
+    """
+
+    if RE_UNSUPPORTED.search(selector):
+        raise ValueError("Unsupported selector operator")
+    parts = split_exclusions(selector.strip())
+    exclusions = []
+    for part in parts[1:]:
+        for alt in expand_groups(part):
+            exclusions.append([tuple(c.split(".")) for c in alt.split()])
+    return [([tuple(c.split(".")) for c in alt.split()], exclusions) for alt in expand_groups(parts[0])]
+
+
+def parse_scope(scope):
+    if not isinstance(scope, (list, tuple)):
+        scope = scope.split()
+    return [tuple(s.split(".")) for s in scope]
+
+
+def prefix_match(component, scope):
+    return len(component) <= len(scope) and scope[0:len(component)] == component
+
+
+def match_ancestors(path, stack, end):
+    """
+    Match the remaining selector components, innermost first, against the scope stack
+    above position end.  Returns the score of each matched component or None.
+    """
+
+    score = []
+    i = end
+    for component in reversed(path):
+        i -= 1
+        while i >= 0 and not prefix_match(component, stack[i]):
+            i -= 1
+        if i < 0:
+            return None
+        score.append((i, len(component)))
+    return score
+
+
+def match_path(path, stack):
+    """Best match of a whole selector path against a scope stack."""
+
+    if not path:
+        return None
+    last = path[-1]
+    for i in range(len(stack) - 1, -1, -1):
+        if prefix_match(last, stack[i]):
+            ancestors = match_ancestors(path[:-1], stack, i)
+            if ancestors is not None:
+                return tuple([(i, len(last))] + ancestors)
+    return None
+
+
+def excluded(exclusions, stack):
+    for path in exclusions:
+        if match_path(path, stack) is not None:
+            return True
+    return False
+
+
+class Node(object):
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children = {}
+        self.entries = []
+
+
+class ScopeIndex(object):
+    """
+    Prefix trie of every rule selector keyed by the atoms of its innermost component.
+    Selectors are scored TextMate style: deeper scope matches win, then longer prefixes,
+    then the rule defined last.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.root = Node()
+        self.selectors = []
+        self.cache = {}
+        self.skipped = []
+        for index, rule in enumerate(rules):
+            try:
+                selectors = split_top(rule.get("scope", ""), ",")
+            except ValueError:
+                selectors = [rule.get("scope", "")]
+            for selector in selectors:
+                try:
+                    parsed = parse_selector(selector)
+                except ValueError as e:
+                    # Better no answer than a wrong one
+                    self.skipped.append((index, selector))
+                    print("ColorSchemeEditor: Skipping scope selector '%s'! (%s)" % (selector.strip(), str(e)))
+                    continue
+                for path, exclusions in parsed:
+                    if not path:
+                        continue
+                    self.selectors.append((index, path, exclusions))
+                    node = self.root
+                    for atom in path[-1]:
+                        node = node.children.setdefault(atom, Node())
+                    node.entries.append((index, path[:-1], exclusions))
+
+    def candidates(self, stack):
+        for i in range(len(stack) - 1, -1, -1):
+            node = self.root
+            depth = 0
+            for atom in stack[i]:
+                node = node.children.get(atom)
+                if node is None:
+                    break
+                depth += 1
+                for index, ancestors, exclusions in node.entries:
+                    yield i, depth, index, ancestors, exclusions
+
+    def match(self, scope):
+        """Return (rule index, score) of the rule that colors the scope or (None, None)."""
+
+        key = scope if not isinstance(scope, (list, tuple)) else " ".join(scope)
+        key = key.strip()
+        if key in self.cache:
+            return self.cache[key]
+
+        stack = parse_scope(scope)
+        best = (None, None)
+        for i, depth, index, ancestors, exclusions in self.candidates(stack):
+            score = match_ancestors(ancestors, stack, i)
+            if score is None:
+                continue
+            score = tuple([(i, depth)] + score)
+            if best[1] is not None and (score, index) < (best[1], best[0]):
+                continue
+            if exclusions and excluded(exclusions, stack):
+                continue
+            best = (index, score)
+
+        if len(self.cache) >= CACHE_SIZE:
+            self.cache.clear()
+        self.cache[key] = best
+        return best
+
+    def match_linear(self, scope):
+        """Reference lookup that scores every selector; used to benchmark the trie."""
+
+        stack = parse_scope(scope)
+        best = (None, None)
+        for index, path, exclusions in self.selectors:
+            score = match_path(path, stack)
+            if score is None:
+                continue
+            if best[1] is not None and (score, index) < (best[1], best[0]):
+                continue
+            if exclusions and excluded(exclusions, stack):
+                continue
+            best = (index, score)
+        return best
+
+
+def benchmark(index, scopes, repeat=100):
+    """Time trie lookups (uncached) against a linear scan.  Returns seconds per lookup."""
+
+    count = float(max(len(scopes) * repeat, 1))
+
+    start = time.time()
+    for _ in range(repeat):
+        for scope in scopes:
+            index.cache.clear()
+            index.match(scope)
+    trie = (time.time() - start) / count
+
+    start = time.time()
+    for _ in range(repeat):
+        for scope in scopes:
+            index.match_linear(scope)
+    linear = (time.time() - start) / count
+    return trie, linear
@@ -0,0 +1,102 @@
+"""
+Color Scheme Editor timing spans
+Licensed under MIT
+Copyright (c) 2013 Isaac Muse <isaacmuse@gmail.com>
+"""
+import json
+import math
+import threading
+import time
+from os.path import exists
+from .file_rotate import rotate
+
+TRACE_FILE = "subclrschm.trace.jsonl"
+MAX_SIZE = 1024 * 1024
+LOCK = threading.Lock()
+ENABLED = False
+TRACE_PATH = None
+
+
+def configure(enabled, path):
+    """Enable or disable tracing; spans are appended as JSON lines to path."""
+
+    global ENABLED
+    global TRACE_PATH
+    TRACE_PATH = path
+    ENABLED = bool(enabled) and path is not None
+
+
+def record(name, elapsed):
+    entry = json.dumps({"name": name, "ms": round(elapsed * 1000.0, 3), "ts": round(time.time(), 3)})
+    with LOCK:
+        try:
+            rotate(TRACE_PATH, MAX_SIZE)
+            with open(TRACE_PATH, "a") as f:
+                f.write(entry + "\n")
+        except Exception as e:
+            print("ColorSchemeEditor: Could not write trace! (%s)" % str(e))
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+class Span(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        record(self.name, time.time() - self.start)
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name):
+    """Time a block with "with span(name):"; costs one global lookup when tracing is disabled."""
+
+    return Span(name) if ENABLED else NULL_SPAN
+
+
+def read_trace(path):
+    durations = {}
+    for p in (path + ".1", path):
+        if not exists(p):
+            continue
+        with open(p, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                durations.setdefault(entry["name"], []).append(entry["ms"])
+    return durations
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    idx = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[min(max(idx, 0), len(ordered) - 1)]
+
+
+def summarize(durations):
+    lines = ["%-40s %6s %10s %10s %10s" % ("phase", "count", "p50 ms", "p95 ms", "max ms")]
+    for name in sorted(durations.keys()):
+        values = durations[name]
+        lines.append(
+            "%-40s %6d %10.2f %10.2f %10.2f" % (
+                name, len(values), percentile(values, 50), percentile(values, 95), max(values)
+            )
+        )
+    if len(lines) == 1:
+        lines.append("No trace data")
+    return "\n".join(lines) + "\n"
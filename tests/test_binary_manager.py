@@ -0,0 +1,240 @@
+"""
+Tests for conditional, hash-verified subclrschm updates.
+A stub sublime module stands in for the editor and a local HTTP server serves fixture archives.
+"""
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import types
+import unittest
+import zipfile
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+PACKAGES = tempfile.mkdtemp(prefix="cse_packages")
+
+sublime = types.ModuleType("sublime")
+sublime.version = lambda: "3126"
+sublime.platform = lambda: "linux"
+sublime.packages_path = lambda: PACKAGES
+sublime.status_message = lambda msg: None
+sublime.error_message = lambda msg: None
+sublime.message_dialog = lambda msg: None
+sublime.set_timeout = lambda fn, delay: None
+sys.modules.setdefault("sublime", sublime)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import binary_manager  # noqa: E402
+
+INSTALL = os.path.join(PACKAGES, "User", "subclrschm", "subclrschm-bin-linux")
+BINARY = os.path.join(INSTALL, "subclrschm")
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """
+    Serve the current fixture archive with an ETag and/or Last-Modified
+    and honor If-None-Match and If-Modified-Since.
+    """
+
+    archive = None
+    send_etag = True
+    last_modified = None
+    requests = []
+
+    def do_GET(self):
+        ArchiveHandler.requests.append(dict(self.headers.items()))
+        if ArchiveHandler.archive is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag = '"%s"' % hashlib.md5(ArchiveHandler.archive).hexdigest()
+        if (
+            (ArchiveHandler.send_etag and self.headers.get("If-None-Match") == etag) or
+            (
+                ArchiveHandler.last_modified is not None and
+                self.headers.get("If-Modified-Since") == ArchiveHandler.last_modified
+            )
+        ):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if ArchiveHandler.send_etag:
+            self.send_header("ETag", etag)
+        if ArchiveHandler.last_modified is not None:
+            self.send_header("Last-Modified", ArchiveHandler.last_modified)
+        self.send_header("Content-Length", str(len(ArchiveHandler.archive)))
+        self.end_headers()
+        self.wfile.write(ArchiveHandler.archive)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_archive(binary=b"subclrschm", include_binary=True):
+    path = os.path.join(tempfile.mkdtemp(prefix="cse_fixture"), "fixture.zip")
+    z = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED)
+    if include_binary:
+        z.writestr("subclrschm-bin-linux/subclrschm", binary)
+    z.writestr("subclrschm-bin-linux/version.json", '{"version": "0.0.8"}')
+    z.close()
+    with open(path, "rb") as f:
+        data = f.read()
+    shutil.rmtree(os.path.dirname(path))
+    return data
+
+
+def corrupt_archive(data, payload):
+    """Flip the first byte of a stored member so the archive opens but fails its CRC check."""
+
+    idx = data.index(payload)
+    return data[:idx] + (b"X" if payload[0:1] != b"X" else b"Y") + data[idx + 1:]
+
+
+def read_binary():
+    with open(BINARY, "rb") as f:
+        return f.read()
+
+
+class TestGetBinary(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), ArchiveHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        binary_manager.REPO = "http://127.0.0.1:%d/%%s.zip" % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(PACKAGES, ignore_errors=True)
+
+    def setUp(self):
+        shutil.rmtree(os.path.join(PACKAGES, "User"), ignore_errors=True)
+        os.makedirs(os.path.join(PACKAGES, "User"))
+        ArchiveHandler.archive = make_archive(b"v1")
+        ArchiveHandler.send_etag = True
+        ArchiveHandler.last_modified = None
+        ArchiveHandler.requests = []
+
+    def update(self):
+        t = binary_manager.GetBinary()
+        t.get_binary()
+        return t
+
+    def test_fresh_install(self):
+        t = self.update()
+        self.assertIsNone(t.error_message)
+        self.assertFalse(t.up_to_date)
+        self.assertEqual(read_binary(), b"v1")
+        manifest = binary_manager.read_manifest(os.path.dirname(INSTALL))
+        self.assertEqual(manifest["archive"], hashlib.sha256(ArchiveHandler.archive).hexdigest())
+        self.assertIn("subclrschm", manifest["files"])
+
+    def test_unchanged_archive_uses_etag(self):
+        self.update()
+        etag = binary_manager.read_manifest(os.path.dirname(INSTALL))["etag"]
+        t = self.update()
+        self.assertIsNone(t.error_message)
+        self.assertTrue(t.up_to_date)
+        self.assertEqual(ArchiveHandler.requests[-1].get("If-None-Match"), etag)
+        self.assertEqual(read_binary(), b"v1")
+
+    def test_unchanged_archive_uses_last_modified(self):
+        ArchiveHandler.send_etag = False
+        ArchiveHandler.last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+        self.update()
+        t = self.update()
+        self.assertIsNone(t.error_message)
+        self.assertTrue(t.up_to_date)
+        self.assertEqual(ArchiveHandler.requests[-1].get("If-Modified-Since"), ArchiveHandler.last_modified)
+        self.assertNotIn("If-None-Match", ArchiveHandler.requests[-1])
+        self.assertEqual(read_binary(), b"v1")
+
+    def test_tampered_install_is_reinstalled(self):
+        self.update()
+        with open(BINARY, "wb") as f:
+            f.write(b"tampered")
+        t = self.update()
+        self.assertIsNone(t.error_message)
+        self.assertFalse(t.up_to_date)
+        # An install that no longer matches the manifest must not send conditional headers
+        self.assertNotIn("If-None-Match", ArchiveHandler.requests[-1])
+        self.assertEqual(read_binary(), b"v1")
+
+    def test_new_archive_is_installed(self):
+        self.update()
+        ArchiveHandler.archive = make_archive(b"v2")
+        t = self.update()
+        self.assertIsNone(t.error_message)
+        self.assertFalse(t.up_to_date)
+        self.assertEqual(read_binary(), b"v2")
+
+    def test_archive_without_binary_is_rejected(self):
+        self.update()
+        ArchiveHandler.archive = make_archive(include_binary=False)
+        t = self.update()
+        self.assertEqual(t.error_message, binary_manager.MSGS["install_verify"])
+        self.assertEqual(read_binary(), b"v1")
+
+    def test_corrupt_archive_is_rejected(self):
+        self.update()
+        ArchiveHandler.archive = corrupt_archive(make_archive(b"v2-payload"), b"v2-payload")
+        t = self.update()
+        self.assertEqual(t.error_message, binary_manager.MSGS["install_verify"])
+        self.assertEqual(read_binary(), b"v1")
+
+    def test_invalid_archive_is_rejected(self):
+        self.update()
+        ArchiveHandler.archive = b"not a zip archive"
+        t = self.update()
+        self.assertEqual(t.error_message, binary_manager.MSGS["install_verify"])
+        self.assertEqual(read_binary(), b"v1")
+
+    def test_swap_leaves_no_staging_folders(self):
+        self.update()
+        ArchiveHandler.archive = make_archive(b"v2")
+        self.update()
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(INSTALL))),
+            ["subclrschm-bin-linux", "subclrschm-bin-linux.manifest.json"]
+        )
+
+    def test_failed_swap_restores_install(self):
+        self.update()
+        ArchiveHandler.archive = make_archive(b"v2")
+        original = binary_manager.rename
+
+        def failing_rename(src, dst):
+            if dst == INSTALL and "staging" in src:
+                raise OSError("rename failed")
+            original(src, dst)
+
+        binary_manager.rename = failing_rename
+        try:
+            t = self.update()
+        finally:
+            binary_manager.rename = original
+        self.assertEqual(t.error_message, binary_manager.MSGS["install_directory"])
+        self.assertEqual(read_binary(), b"v1")
+
+    def test_missing_archive_leaves_install(self):
+        self.update()
+        ArchiveHandler.archive = None
+        with open(BINARY, "wb") as f:
+            f.write(b"tampered")
+        t = self.update()
+        self.assertEqual(t.error_message, binary_manager.MSGS["install_download"])
+        self.assertEqual(read_binary(), b"tampered")
+
+
+if __name__ == "__main__":
+    unittest.main()